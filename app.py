@@ -0,0 +1,956 @@
+#!/usr/bin/env python3
+"""podmon: Kubernetes pod monitor with a small Flask API.
+
+Watches pods and services, records status/image changes, metrics, ports
+and node stats to SQLite, and sends alerts by email/WhatsApp/SMS.
+"""
+
+import functools
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.mime.text import MIMEText
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+import requests
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from requests.adapters import HTTPAdapter, Retry
+from flask import Flask, jsonify, request
+from flask.json.provider import JSONProvider
+from kubernetes import client, config, watch
+from kubernetes.client.rest import ApiException
+
+from database import Database
+
+DATA_DIR = os.environ.get('PODMON_DATA', '/app/data')
+
+class _BufferedFileHandler(logging.FileHandler):
+    """File handler that skips the per-record flush.
+
+    StreamHandler.emit flushes after every record, which makes each
+    log line a write+flush syscall pair. Here the stream carries a
+    64 KiB buffer, only ERROR and above force the flush, and a
+    background timer drains the buffer for lower levels.
+    """
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, encoding=self.encoding,
+                    buffering=64 * 1024)
+
+    def emit(self, record):
+        self._force_flush = record.levelno >= logging.ERROR
+        super().emit(record)
+
+    def flush(self):
+        if getattr(self, '_force_flush', True):
+            super().flush()
+
+    def flush_now(self):
+        logging.StreamHandler.flush(self)
+
+
+def _setup_logging():
+    """Decouple log emission from disk with a queue and listener.
+
+    Application threads only enqueue records; the listener thread
+    owns the real handlers, so a slow disk never blocks the watch or
+    request paths.
+    """
+    formatter = logging.Formatter(
+        '%(asctime)s %(levelname)s %(name)s: %(message)s')
+    file_handler = _BufferedFileHandler(os.path.join(DATA_DIR, 'podmon.log'))
+    stream_handler = logging.StreamHandler()
+    file_handler.setFormatter(formatter)
+    stream_handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, stream_handler,
+                             respect_handler_level=True)
+    listener.start()
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(QueueHandler(log_queue))
+
+    def _flush_loop():
+        while True:
+            time.sleep(5)
+            file_handler.flush_now()
+
+    threading.Thread(target=_flush_loop, daemon=True,
+                     name='podmon-logflush').start()
+
+
+_setup_logging()
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson.
+
+    The /api/pods payload nests dicts for every pod and port; orjson
+    encodes it several times faster than the stdlib encoder and
+    handles datetimes natively.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+app.json = OrjsonProvider(app)
+
+# Binary suffixes used by Kubernetes quantity strings, keyed by the
+# two-character suffix so parsing is one slice and one dict lookup.
+_QTY_SUFFIX = {'Ki': 1 << 10, 'Mi': 1 << 20,
+               'Gi': 1 << 30, 'Ti': 1 << 40}
+
+# Nodes change far less often than pods, so a short stale-tolerant
+# snapshot is enough; pods and services are kept fresh by watches.
+_NODE_CACHE_TTL = 30
+
+
+def _hhmm_to_sec(value):
+    """Convert an "HH:MM" schedule bound to seconds of the day."""
+    hh, mm = value.split(':')
+    return int(hh) * 3600 + int(mm) * 60
+
+
+@functools.lru_cache(maxsize=4096)
+def _is_local(name):
+    """Whether the pod name marks it as a local/dev workload.
+
+    Names repeat every cycle, so the lowercased scan is memoized.
+    """
+    return 'local' in name.casefold()
+
+
+def _cpu_millicores(value):
+    """Parse a CPU quantity ("100m", "1.5") into millicores."""
+    if value is None:
+        return None
+    value = str(value)
+    try:
+        if value.endswith('m'):
+            return int(float(value[:-1]))
+        return int(float(value) * 1000)
+    except ValueError:
+        return None
+
+
+def _memory_bytes(value):
+    """Parse a memory quantity ("512Mi", "2Gi") into bytes."""
+    if value is None:
+        return None
+    value = str(value)
+    mul = _QTY_SUFFIX.get(value[-2:])
+    try:
+        if mul:
+            return int(float(value[:-2]) * mul)
+        return int(value)
+    except ValueError:
+        return None
+
+
+class PodMonitor:
+    def __init__(self, db):
+        self.db = db
+        self.config = self.load_config()
+        self._compile_schedules()
+
+        try:
+            config.load_incluster_config()
+        except config.ConfigException:
+            config.load_kube_config()
+        self.v1 = client.CoreV1Api()
+
+        # Local caches kept current by long-lived watch streams, so a
+        # refresh cycle iterates memory instead of re-LISTing the whole
+        # cluster from the API server every interval.
+        # Blocking I/O (per-pod exec probes, alert webhooks, SMTP) is
+        # overlapped on a bounded pool so a cycle costs roughly the
+        # slowest call instead of the sum of all of them.
+        self._io_pool = ThreadPoolExecutor(max_workers=16,
+                                           thread_name_prefix='podmon-io')
+
+        # One session with a keep-alive pool for the alert webhooks, so
+        # a multi-recipient broadcast reuses TLS connections instead of
+        # paying a handshake per recipient.
+        self._http = requests.Session()
+        retry = Retry(total=2, backoff_factor=0.2,
+                      status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32,
+                              max_retries=retry)
+        self._http.mount('https://', adapter)
+        self._http.mount('http://', adapter)
+
+        # Outbound mail is serialized through one queue and one sender
+        # thread that owns a long-lived SMTP connection, so an alert
+        # burst pays the TCP+TLS+AUTH handshake once, not per mail.
+        self._smtp = None
+        self._mailq = queue.Queue()
+        threading.Thread(target=self._mail_loop, daemon=True,
+                         name='podmon-mail').start()
+
+        self._cache_lock = threading.Lock()
+        self._pod_cache = {}
+        self._svc_cache = {}
+        self._node_cache = None
+        self._node_cache_ts = 0.0
+        # Last complete reports, rebuilt by the scheduler jobs; the API
+        # serves these so request latency does not depend on the
+        # apiserver. Plain rebinding keeps reads lock-free.
+        self._pods_snapshot = []
+        self._nodes_snapshot = {}
+        self._last_refresh = time.monotonic()
+        # Last seen (status, image) per pod, seeded from pod_current so
+        # change detection survives restarts without a SELECT per pod.
+        self._last_status = {
+            (row[1], row[0]): (row[2], row[4])
+            for row in db.get_pods_current()
+        }
+        # "Was the image updated this week" almost never changes, so
+        # the per-pod SELECT is cached; entries are refreshed hourly
+        # and overwritten immediately when an image change lands.
+        self._image_update_cache = {}
+        self._image_update_epoch = 0
+        # creation_timestamp is immutable per pod UID, so its ISO form
+        # is rendered once and reused every cycle.
+        self._created_iso = {}
+        # Scope the list/watch server-side: with namespaces configured,
+        # one watch per namespace means the API server only ever sends
+        # objects we monitor, instead of the whole cluster filtered
+        # client-side.
+        namespaces = self.config['monitoring']['namespaces']
+        if namespaces:
+            for ns in namespaces:
+                self._start_watch('pods', self._pod_cache, ns,
+                                  self.v1.list_namespaced_pod, ns)
+                self._start_watch('services', self._svc_cache, ns,
+                                  self.v1.list_namespaced_service, ns)
+        else:
+            self._start_watch('pods', self._pod_cache, None,
+                              self.v1.list_pod_for_all_namespaces)
+            self._start_watch('services', self._svc_cache, None,
+                              self.v1.list_service_for_all_namespaces)
+
+    def _start_watch(self, what, cache, namespace, list_func, *args):
+        """Spawn a watcher thread for one list endpoint.
+
+        list_func must be the bound API method itself (extra positional
+        args, e.g. the namespace, are passed through): Watch.stream
+        reads the method's docstring to pick the model type for event
+        deserialization, so wrapping it in a lambda would leave events
+        as plain dicts.
+        """
+        name = f"{what}-watch" + (f"-{namespace}" if namespace else '')
+        threading.Thread(target=self._watch_loop, daemon=True, name=name,
+                         args=(what, cache, namespace, list_func, args)).start()
+
+    # ------------------------------------------------------------------
+    # configuration
+
+    def get_default_config(self):
+        return {
+            'monitoring': {
+                'namespaces': [],
+                'refresh_interval': 600,
+                'retention_days': 30,
+                'alert_schedule': [
+                    {
+                        'start': '08:00',
+                        'end': '18:00',
+                        'levels': ['info', 'warning', 'error', 'critical'],
+                        'namespaces': [],
+                    },
+                    {
+                        'start': '18:00',
+                        'end': '08:00',
+                        'levels': ['error', 'critical'],
+                        'namespaces': [],
+                    },
+                ],
+            },
+            'email': {
+                'enabled': False,
+                'smtp_server': '',
+                'smtp_port': 587,
+                'username': '',
+                'password': '',
+                'from_address': '',
+                'recipients': [],
+            },
+            'whatsapp': {
+                'enabled': False,
+                'api_url': '',
+                'api_token': '',
+                'recipients': [],
+            },
+            'sms': {
+                'enabled': False,
+                'api_url': '',
+                'api_token': '',
+                'recipients': [],
+            },
+        }
+
+    def load_config(self):
+        cfg = self.get_default_config()
+        saved = self.db.get_config()
+        for section, values in saved.items():
+            if section in cfg and isinstance(values, dict):
+                cfg[section].update(values)
+            else:
+                cfg[section] = values
+        self.db.save_config(cfg)
+        return cfg
+
+    def save_config(self, cfg):
+        """Merge a (possibly partial) config onto the current one.
+
+        Mirrors load_config's merge so every default section survives
+        a partial POST; replacing self.config wholesale would let a
+        sparse payload knock out the sections send_alert and
+        _compile_schedules rely on.
+        """
+        merged = {section: dict(values) if isinstance(values, dict)
+                  else values
+                  for section, values in self.config.items()}
+        for section, values in cfg.items():
+            if isinstance(merged.get(section), dict) and \
+                    isinstance(values, dict):
+                merged[section].update(values)
+            else:
+                merged[section] = values
+        self.config = merged
+        self.db.save_config(merged)
+        self._compile_schedules()
+
+    def _compile_schedules(self):
+        """Pre-parse the alert schedule windows.
+
+        strptime costs ~10us per call and should_send_alert ran it
+        twice per window per alert; the windows only change when the
+        config does, so they are compiled here instead.
+        """
+        compiled = []
+        for sched in self.config['monitoring']['alert_schedule']:
+            try:
+                start = _hhmm_to_sec(sched['start'])
+                end = _hhmm_to_sec(sched['end'])
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"Skipping malformed alert schedule "
+                             f"{sched}: {e}")
+                continue
+            compiled.append((start, end,
+                             frozenset(sched.get('levels', ())),
+                             frozenset(sched.get('namespaces', ()))))
+        self._schedules = compiled
+
+    # ------------------------------------------------------------------
+    # cluster caches
+
+    def _watch_loop(self, what, cache, namespace, list_func, args):
+        """List once to seed the cache, then apply watch events forever.
+
+        A namespace-scoped watcher only reseeds its own slice of the
+        shared cache. On a 410 Gone (our resourceVersion aged out of the
+        API server's window) the loop re-lists and resumes from the
+        fresh version.
+        """
+        while True:
+            try:
+                # resource_version='0' lets the apiserver answer from
+                # its watch cache instead of a quorum etcd read; the
+                # timeouts keep a hung apiserver from wedging the loop.
+                listing = list_func(*args, watch=False,
+                                    resource_version='0',
+                                    timeout_seconds=15, _request_timeout=20)
+                with self._cache_lock:
+                    for key in [k for k in cache
+                                if namespace is None or k[0] == namespace]:
+                        del cache[key]
+                    for obj in listing.items:
+                        cache[(obj.metadata.namespace, obj.metadata.name)] = obj
+                if what == 'pods':
+                    # Diff the relisted state too, so transitions that
+                    # happened during a watch gap are still detected.
+                    for obj in listing.items:
+                        self._on_pod_event('MODIFIED', obj)
+                version = listing.metadata.resource_version
+                w = watch.Watch()
+                for event in w.stream(list_func, *args,
+                                      resource_version=version):
+                    obj = event['object']
+                    key = (obj.metadata.namespace, obj.metadata.name)
+                    with self._cache_lock:
+                        if event['type'] == 'DELETED':
+                            cache.pop(key, None)
+                        else:
+                            cache[key] = obj
+                    if what == 'pods':
+                        self._on_pod_event(event['type'], obj)
+            except ApiException as e:
+                if e.status == 410:
+                    logger.info(f"{what} watch expired, relisting")
+                    continue
+                logger.error(f"Error watching {what}: {e}")
+                time.sleep(5)
+            except Exception as e:
+                logger.error(f"Error watching {what}: {e}")
+                time.sleep(5)
+
+    def _on_pod_event(self, event_type, pod):
+        """Diff a watch event against the last seen state of the pod.
+
+        Runs on the watcher thread, so transitions alert within a
+        second of the event instead of waiting for the next cycle.
+        """
+        key = (pod.metadata.namespace, pod.metadata.name)
+        if event_type == 'DELETED':
+            self._last_status.pop(key, None)
+            self._created_iso.pop(pod.metadata.uid, None)
+            return
+        image = pod.spec.containers[0].image if pod.spec.containers else ''
+        self.check_pod_changes(pod.metadata.name, pod.metadata.namespace,
+                               pod.status.phase, image)
+
+    def _pods(self):
+        with self._cache_lock:
+            return list(self._pod_cache.values())
+
+    def _services(self):
+        with self._cache_lock:
+            return list(self._svc_cache.values())
+
+    def _nodes(self):
+        """Node list behind a TTL so bursts share one apiserver LIST.
+
+        The response is taken raw and decoded with orjson into plain
+        dicts: we read a handful of fields per node, which does not
+        justify inflating full swagger models through the client's
+        reflective deserializer.
+        """
+        now = time.monotonic()
+        if self._node_cache is None or \
+                now - self._node_cache_ts > _NODE_CACHE_TTL:
+            resp = self.v1.list_node(_preload_content=False,
+                                     _request_timeout=20)
+            self._node_cache = orjson.loads(resp.data)['items']
+            self._node_cache_ts = now
+        return self._node_cache
+
+    def _service_index(self):
+        """Bucket services by namespace with their selector as a frozenset.
+
+        Built once per cycle so per-pod matching is a subset check
+        against the handful of services in the pod's namespace instead
+        of a selector-key loop over every service in the cluster.
+        """
+        index = defaultdict(list)
+        for svc in self._services():
+            if not svc.spec.selector:
+                continue
+            selector = frozenset(svc.spec.selector.items())
+            index[svc.metadata.namespace].append((svc, selector))
+        return index
+
+    # ------------------------------------------------------------------
+    # pod information
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def format_resources(value, unit):
+        """Format a Kubernetes quantity string for display.
+
+        The cluster reuses a small set of quantity strings ("100m",
+        "512Mi", ...), so the parse is memoized; the function is pure.
+        """
+        try:
+            if value is None:
+                return 'N/A'
+            value = str(value)
+            if unit == 'cpu':
+                if value.endswith('m'):
+                    return value
+                return f"{int(float(value) * 1000)}m"
+            mul = _QTY_SUFFIX.get(value[-2:])
+            if mul:
+                value = int(value[:-2]) * mul
+            else:
+                value = int(value)
+            if value >= 1024 * 1024 * 1024:
+                return f"{value / (1024 * 1024 * 1024):.2f} GB"
+            if value >= 1024 * 1024:
+                return f"{value / (1024 * 1024):.2f} MB"
+            if value >= 1024:
+                return f"{value / 1024:.2f} KB"
+            return f"{value} B"
+        except (ValueError, TypeError):
+            return 'N/A'
+
+    def _node_summary(self, node_name):
+        """Fetch the kubelet stats summary for one node.
+
+        Taken raw: the generated client declares this endpoint as str
+        and would round-trip the JSON through a Python repr, which no
+        longer parses.
+        """
+        resp = self.v1.connect_get_node_proxy_with_path(
+            node_name, 'stats/summary', _request_timeout=10,
+            _preload_content=False)
+        return orjson.loads(resp.data)
+
+    def get_disk_usage_by_pod(self, node_names):
+        """Map (namespace, name) -> ephemeral-storage bytes used.
+
+        One kubelet stats/summary GET per node replaces the old
+        per-pod df exec probe; the summary already carries disk usage
+        for every pod on the node.
+        """
+        disk_by_pod = {}
+        futures = {
+            node: self._io_pool.submit(self._node_summary, node)
+            for node in node_names
+        }
+        for node, future in futures.items():
+            try:
+                summary = future.result(timeout=15)
+            except Exception as e:
+                logger.debug(f"Could not read stats summary for "
+                             f"{node}: {e}")
+                continue
+            for pod_stats in summary.get('pods', []):
+                ref = pod_stats.get('podRef', {})
+                usage = pod_stats.get('ephemeral-storage', {})
+                used = usage.get('usedBytes')
+                if used is not None:
+                    disk_by_pod[(ref.get('namespace'),
+                                 ref.get('name'))] = used
+        return disk_by_pod
+
+    def get_pod_ports(self, pod, svcs_in_ns):
+        """Collect container ports plus the pod's external IP.
+
+        svcs_in_ns is the (service, selector_frozenset) list for the
+        pod's namespace from _service_index(). Returns a dict with
+        'ports' and 'external_ip' so the caller does not have to match
+        selectors a second time for the IP.
+        """
+        ports_info = []
+        external_ip = None
+        try:
+            pod_labels = frozenset((pod.metadata.labels or {}).items())
+            # Unlabelled pods can't be selected, and the selector match
+            # is identical for every port, so resolve it once per pod
+            # instead of per (service, port) pair.
+            matched = [svc for svc, selector in svcs_in_ns
+                       if selector <= pod_labels] if pod_labels else []
+            for container in pod.spec.containers:
+                if not container.ports:
+                    continue
+                for port in container.ports:
+                    # The generated client models always define these
+                    # attributes; they are just None when unset.
+                    port_info = {
+                        'port': port.container_port,
+                        'protocol': port.protocol or 'TCP',
+                        'name': port.name or '',
+                        'is_exposed': False,
+                        'service_name': None,
+                        'external_ip': None,
+                    }
+                    for svc in matched:
+                        for svc_port in svc.spec.ports or []:
+                            target = svc_port.target_port
+                            if target == port_info['port'] or \
+                                    target == port_info['name']:
+                                port_info['is_exposed'] = True
+                                port_info['service_name'] = svc.metadata.name
+                                if svc.status.load_balancer.ingress:
+                                    ip = svc.status.load_balancer \
+                                            .ingress[0].ip
+                                    port_info['external_ip'] = ip
+                                    external_ip = ip
+                    ports_info.append(port_info)
+        except Exception as e:
+            logger.error(f"Error getting ports for {pod.metadata.name}: {e}")
+        return {'ports': ports_info, 'external_ip': external_ip}
+
+    def _image_updated(self, name, namespace):
+        key = (name, namespace)
+        if key not in self._image_update_cache:
+            self._image_update_cache[key] = \
+                self.db.check_recent_image_update(name, namespace)
+        return self._image_update_cache[key]
+
+    def get_pods_info(self):
+        """Build the full pod report and persist the cycle to the DB."""
+        pods_info = []
+        try:
+            # The watches are already scoped to the configured
+            # namespaces, so the cache holds exactly the monitored pods.
+            svc_index = self._service_index()
+            now = datetime.now(timezone.utc)
+            pods = self._pods()
+            disk_by_pod = self.get_disk_usage_by_pod(
+                {pod.spec.node_name for pod in pods if pod.spec.node_name})
+            ports_by_pod = {}
+            metrics_rows = []
+            epoch = int(time.time() // 3600)
+            if epoch != self._image_update_epoch:
+                self._image_update_cache.clear()
+                self._image_update_epoch = epoch
+            seven_days_ago = now - timedelta(days=7)
+            for pod in pods:
+                # Bind the swagger sub-objects once; every dotted access
+                # goes through a generated property descriptor.
+                meta = pod.metadata
+                status = pod.status
+                spec = pod.spec
+                name = meta.name
+                namespace = meta.namespace
+                containers = spec.containers
+
+                creation_time = meta.creation_timestamp
+                created_iso = self._created_iso.get(meta.uid)
+                if created_iso is None:
+                    created_iso = creation_time.isoformat()
+                    self._created_iso[meta.uid] = created_iso
+                image = containers[0].image if containers else ''
+
+                pod_info = {
+                    'name': name,
+                    'namespace': namespace,
+                    'status': status.phase,
+                    'node': spec.node_name,
+                    'image': image,
+                    'created': created_iso,
+                    'age_days': (now - creation_time).days,
+                    'is_new': creation_time > seven_days_ago,
+                    'is_local': _is_local(name),
+                    'ips': {
+                        'internal': status.pod_ip,
+                        'external': None,
+                    },
+                    'image_updated': self._image_updated(name, namespace),
+                }
+
+                svcs_in_ns = svc_index.get(namespace, ())
+                port_data = self.get_pod_ports(pod, svcs_in_ns)
+                ports_info = port_data['ports']
+                pod_info['ports'] = ports_info
+                pod_info['ips']['external'] = port_data['external_ip']
+
+                # Aggregate limits across every container as numbers;
+                # strings are only produced at the display boundary and
+                # the DB keeps the raw values.
+                cpu_m = mem_b = None
+                for container in containers or []:
+                    limits = container.resources.limits or {}
+                    cpu = _cpu_millicores(limits.get('cpu'))
+                    mem = _memory_bytes(limits.get('memory'))
+                    if cpu is not None:
+                        cpu_m = (cpu_m or 0) + cpu
+                    if mem is not None:
+                        mem_b = (mem_b or 0) + mem
+                disk_b = disk_by_pod.get((namespace, name))
+                pod_info['resources'] = {
+                    'cpu': f"{cpu_m}m" if cpu_m is not None else 'N/A',
+                    'memory': self.format_resources(mem_b, 'memory'),
+                    'disk': self.format_resources(disk_b, 'disk'),
+                }
+                pods_info.append(pod_info)
+
+                ports_by_pod[(name, namespace)] = ports_info
+                metrics_rows.append(
+                    (name, namespace, cpu_m, mem_b, disk_b))
+
+            # One transaction per table for the whole cycle instead of
+            # a round of single-row writes per pod.
+            if pods_info:
+                self.db.save_pod_states_bulk(pods_info)
+                self.db.save_pod_metrics_bulk(metrics_rows)
+                self.db.save_pod_ports_bulk(ports_by_pod)
+        except Exception as e:
+            logger.error(f"Error collecting pod info: {e}")
+        self._pods_snapshot = pods_info
+        self._last_refresh = time.monotonic()
+        return pods_info
+
+    def pods_snapshot(self):
+        """Last published pod report, kicking a refresh if it is stale.
+
+        The scheduler normally keeps the snapshot fresh; if it has
+        missed two intervals (e.g. a wedged cycle), serve the stale
+        data but trigger a rebuild in the background.
+        """
+        interval = self.config['monitoring']['refresh_interval']
+        if time.monotonic() - self._last_refresh > 2 * interval:
+            self._last_refresh = time.monotonic()
+            self._io_pool.submit(self.get_pods_info)
+        return self._pods_snapshot
+
+    def check_pod_changes(self, name, namespace, status, image):
+        """Record and alert on status or image transitions.
+
+        Compares against the in-memory last-seen state, so detection
+        costs a dict lookup rather than a SELECT per pod.
+        """
+        try:
+            previous = self._last_status.get((namespace, name))
+            self._last_status[(namespace, name)] = (status, image)
+            if previous is None:
+                return
+            old_status, old_image = previous
+            if old_status != status:
+                self.db.save_status_change(name, namespace,
+                                           old_status, status)
+                level = 'critical' if status in ('Failed', 'Unknown') \
+                    else 'warning'
+                self.send_alert(
+                    name, namespace, level,
+                    f"Pod {name} status changed: {old_status} -> {status}")
+            if old_image and old_image != image:
+                self.db.save_image_change(name, namespace, old_image, image)
+                self._image_update_cache[(name, namespace)] = True
+                self.send_alert(
+                    name, namespace, 'info',
+                    f"Pod {name} image changed: {old_image} -> {image}")
+        except Exception as e:
+            logger.error(f"Error checking changes for {name}: {e}")
+
+    def get_node_stats(self, pods=None):
+        """Collect node capacity/usage and per-node pod counts.
+
+        Pod counts come from the watch cache (or a caller-provided
+        list), so the only remote call here is the TTL-cached node
+        LIST.
+        """
+        node_stats = {}
+        try:
+            nodes = self._nodes()
+            if pods is None:
+                pods = self._pods()
+            for node in nodes:
+                status = node.get('status') or {}
+                ready = 'NotReady'
+                for condition in status.get('conditions') or []:
+                    if condition['type'] == 'Ready' and \
+                            condition['status'] == 'True':
+                        ready = 'Ready'
+                allocatable = status.get('allocatable') or {}
+                capacity = status.get('capacity') or {}
+                node_stats[node['metadata']['name']] = {
+                    'status': ready,
+                    'pods': 0,
+                    'cpu': self.format_resources(
+                        allocatable.get('cpu'), 'cpu'),
+                    'memory': self.format_resources(
+                        allocatable.get('memory'), 'memory'),
+                    'capacity_cpu': self.format_resources(
+                        capacity.get('cpu'), 'cpu'),
+                    'capacity_memory': self.format_resources(
+                        capacity.get('memory'), 'memory'),
+                }
+            for pod in pods:
+                if pod.spec.node_name in node_stats:
+                    node_stats[pod.spec.node_name]['pods'] += 1
+            self.db.save_node_stats(node_stats)
+        except Exception as e:
+            logger.error(f"Error collecting node stats: {e}")
+        self._nodes_snapshot = node_stats
+        return node_stats
+
+    # ------------------------------------------------------------------
+    # alerting
+
+    def should_send_alert(self, level, namespace):
+        """Check the configured schedule windows for this alert."""
+        try:
+            dt = datetime.now()
+            now = dt.hour * 3600 + dt.minute * 60 + dt.second
+            for start, end, levels, namespaces in self._schedules:
+                if start <= end:
+                    in_window = start <= now <= end
+                else:
+                    in_window = now >= start or now <= end
+                if not in_window:
+                    continue
+                if level not in levels:
+                    continue
+                if namespaces and namespace not in namespaces:
+                    continue
+                return True
+            return False
+        except Exception as e:
+            logger.error(f"Error evaluating alert schedule: {e}")
+            return True
+
+    def send_alert(self, pod_name, namespace, level, message):
+        if not self.should_send_alert(level, namespace):
+            return
+        self.db.save_alert(pod_name, namespace, level, message)
+        # Channel sends are fire-and-forget on the I/O pool; the senders
+        # already log their own failures.
+        if self.config['email']['enabled']:
+            self.send_email_alert(level, message)
+        if self.config['whatsapp']['enabled']:
+            self._io_pool.submit(self.send_whatsapp_alert, level, message)
+        if self.config['sms']['enabled']:
+            self._io_pool.submit(self.send_sms_alert, level, message)
+
+    def send_email_alert(self, level, message):
+        self._mailq.put((level, message))
+
+    def _get_smtp(self):
+        """Return the live SMTP connection, reconnecting if it dropped.
+
+        Only the mail thread touches the connection, so no lock is
+        needed; a failed NOOP just triggers a fresh handshake.
+        """
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except Exception:
+                pass
+            self._smtp = None
+        cfg = self.config['email']
+        smtp = smtplib.SMTP(cfg['smtp_server'], cfg['smtp_port'],
+                            timeout=10)
+        smtp.starttls()
+        if cfg['username']:
+            smtp.login(cfg['username'], cfg['password'])
+        self._smtp = smtp
+        return smtp
+
+    def _mail_loop(self):
+        while True:
+            level, message = self._mailq.get()
+            try:
+                cfg = self.config['email']
+                msg = MIMEText(message)
+                msg['Subject'] = f"[podmon:{level}] pod alert"
+                msg['From'] = cfg['from_address']
+                msg['To'] = ', '.join(cfg['recipients'])
+                self._get_smtp().send_message(msg)
+            except Exception as e:
+                self._smtp = None
+                logger.error(f"Error sending email alert: {e}")
+            finally:
+                self._mailq.task_done()
+
+    def _post_alert(self, channel, url, token, payload):
+        try:
+            self._http.post(
+                url,
+                headers={'Authorization': f"Bearer {token}"},
+                json=payload,
+                timeout=10,
+            )
+        except Exception as e:
+            logger.error(f"Error sending {channel} alert: {e}")
+
+    def send_whatsapp_alert(self, level, message):
+        cfg = self.config['whatsapp']
+        for recipient in cfg['recipients']:
+            self._io_pool.submit(
+                self._post_alert, 'WhatsApp', cfg['api_url'],
+                cfg['api_token'],
+                {'to': recipient, 'message': f"[{level}] {message}"})
+
+    def send_sms_alert(self, level, message):
+        cfg = self.config['sms']
+        for recipient in cfg['recipients']:
+            self._io_pool.submit(
+                self._post_alert, 'SMS', cfg['api_url'], cfg['api_token'],
+                {'to': recipient, 'message': f"[{level}] {message}"})
+
+    def cleanup_old_data(self):
+        self.db.cleanup_old_data(self.config['monitoring']['retention_days'])
+
+
+db = Database(os.path.join(DATA_DIR, 'podmon.db'))
+monitor = PodMonitor(db)
+
+
+# ----------------------------------------------------------------------
+# HTTP API
+
+@app.route('/health')
+def health():
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/api/pods')
+def get_pods():
+    return jsonify(monitor.pods_snapshot())
+
+
+@app.route('/api/nodes')
+def get_nodes():
+    return jsonify(monitor._nodes_snapshot)
+
+
+@app.route('/api/metrics/<namespace>/<pod_name>')
+def get_metrics(namespace, pod_name):
+    hours = request.args.get('hours', 24, type=int)
+    rows = monitor.db.get_pod_metrics(pod_name, namespace, hours=hours)
+    return jsonify([row._asdict() for row in rows])
+
+
+@app.route('/api/history')
+def get_history():
+    hours = request.args.get('hours', 24, type=int)
+    limit = request.args.get('limit', 200, type=int)
+    rows = monitor.db.get_recent_changes(hours=hours, limit=limit)
+    return jsonify([
+        {'kind': kind, 'pod_name': pod_name, 'namespace': namespace,
+         'old_value': old, 'new_value': new, 'created_at': created_at}
+        for kind, pod_name, namespace, old, new, created_at in rows
+    ])
+
+
+@app.route('/api/config', methods=['GET', 'POST'])
+def config_endpoint():
+    if request.method == 'POST':
+        monitor.save_config(request.get_json(force=True))
+        return jsonify({'status': 'saved'})
+    return jsonify(monitor.config)
+
+
+def start_scheduler():
+    """Run the refresh jobs and the daily cleanup on a scheduler.
+
+    Unlike the old sleep loop, the interval holds steady regardless of
+    how long a cycle takes, and max_instances keeps a slow cycle from
+    overlapping the next one.
+    """
+    interval = monitor.config['monitoring']['refresh_interval']
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(monitor.get_pods_info, 'interval', seconds=interval,
+                      max_instances=1, coalesce=True,
+                      next_run_time=datetime.now())
+    scheduler.add_job(monitor.get_node_stats, 'interval', seconds=interval,
+                      max_instances=1, coalesce=True,
+                      next_run_time=datetime.now())
+    scheduler.add_job(monitor.cleanup_old_data,
+                      CronTrigger(hour=0, minute=0))
+    scheduler.start()
+    return scheduler
+
+
+if __name__ == '__main__':
+    start_scheduler()
+    app.run(host='0.0.0.0', port=5000)